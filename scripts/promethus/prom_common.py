@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+
+import re
+import sys
+
+# Helpers shared by prom_py and the prom_extract/* scripts, kept in one place
+# where scripts have to agree on the same input format, eg. a step written by
+# dashboard_compile.py has to be accepted by prom-extract.py -f.
+
+def sys_exit(str):
+    print(f"{str}")
+    sys.exit(1)
+
+# promethus duration units, "ms" is listed first so it is not read as "m"
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "y": 31536000}
+
+def duration_seconds(duration):
+    """
+    Convert a promethus duration such as "500ms", "30s" or "1h30m", or a plain
+    number of seconds, to float seconds
+    """
+    if re.fullmatch(r"\d+(\.\d+)?", str(duration)):
+        return float(duration)
+    parts = re.findall(r"(\d+)(ms|s|m|h|d|w|y)", str(duration))
+    if not parts or "".join(f"{n}{u}" for n, u in parts) != duration:
+        sys_exit(f"invalid duration '{duration}', expecting a format like 500ms, 30s, 5m or 1h")
+    return float(sum(int(n) * DURATION_UNITS[u] for n, u in parts))
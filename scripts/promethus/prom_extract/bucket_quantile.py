@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import csv
+import sys
+import json
+import argparse
+import subprocess
+import yaml
+import numpy as np
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from prom_series import SeriesSet
+
+# Compute histogram quantiles client side from raw _bucket rates.
+#
+# A histogram profile such as metric_profiles/etcd_profile wraps every query in
+# histogram_quantile(0.99, ...), so each extra percentile re-runs the whole
+# irate/sum over the buckets on promethus. Here the inner bucket query is pulled
+# once per histogram and any number of quantiles, plus a bucket heatmap, are
+# interpolated locally following the promethus histogram_quantile rules.
+#
+# usage:
+#   ./bucket_quantile.py -p ../metric_profiles/etcd_profile --filter 'namespace=~"clusters-kv.*"' \
+#       --start 2025-11-20T05:08:00Z --end 2025-11-20T07:42:59Z --step 30s -q 0.5 0.9 0.99 0.999 -o /tmp/etcd
+#   ./bucket_quantile.py -j /tmp/etcd/etcd_disk_wal_fsync#buckets.json -q 0.5 0.99
+
+def sys_exit(str):
+    print(f"{str}")
+    sys.exit(1)
+
+def file_is_readable(file_path):
+    if not os.access(file_path, os.R_OK):
+        print(f"The file at '{file_path}' is not readable")
+        return False
+    return True
+
+def obj_exist(obj):
+    return obj is not None
+
+def unix_time(date_str):
+    """
+    Convert a date string in format "YYYY-MM-DD HH:MM:SS" to Unix timestamp in UTC
+
+    Args:
+        date_str (str): Date string in format "YYYY-MM-DD HH:MM:SS"
+
+    Returns:
+        int: Unix timestamp in seconds
+    """
+    return int(datetime.fromisoformat(date_str).replace(tzinfo=timezone.utc).timestamp())
+
+def read_json_file(file_path):
+    try:
+        with open(file_path, "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        print(f"Error: file '{file_path}' does not exists")
+    except IOError:
+        print(f"Error: could not open file '{file_path}'")
+
+def read_yaml(file_path):
+    if file_is_readable(file_path):
+         with open(file_path, 'r') as file:
+            return yaml.safe_load(file)
+
+# validate a promethus response and convert its result into a SeriesSet,
+# with required=False an error status or an empty result returns None instead of exiting
+def check_meta_data(json_obj, required=True):
+    status = json_obj.get("status")
+    if obj_exist(status) and status == "success":
+        print("Promethus query status returned success")
+    else:
+        message = f"Promethus query status returned non-success or status value is not present: {json_obj.get('error')}"
+        if required:
+            sys_exit(message)
+        print(message)
+        return None
+    data = json_obj.get("data") or {}
+    res_type = data.get("resultType")
+    res = data.get("result")
+    if obj_exist(res_type) and obj_exist(res) and len(res) >= 1:
+        print(f"total of {len(res)} entries of data found, resultType: {res_type}")
+        return SeriesSet.from_json(res, release=True)
+    if required:
+        sys_exit("No data found, please check your json file")
+    print("No data found")
+    return None
+
+# rows expects a list of arrays
+def csv_write_rows(path, rows):
+    try:
+        with open(path, mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerows(rows)
+    except Exception as e:
+        print(f"Error: '{e}' occured while writing data into '{path}'")
+
+def curl_promethus_endpoint(query_expression, start, end, step):
+    urlencode_cmd = ["urlencode", query_expression]
+    encoded_url = subprocess.run(urlencode_cmd, capture_output=True, text="True")
+    encoded_expr = encoded_url.stdout.replace('\n', '').replace('\r', '')
+    curl_cmd = (
+            f"oc exec -n openshift-monitoring -c prometheus prometheus-k8s-1 -- "
+            f"curl -s 'http://localhost:9090/api/v1/query_range?"
+            f"query={encoded_expr}&start={start}&end={end}&step={step}'"
+    )
+    query_result = subprocess.run(curl_cmd, capture_output=True, shell=True, text=True)
+    if query_result.returncode != 0:
+        print(f"Error executing query: {query_result.stderr}")
+        return None
+    try:
+        return json.loads(query_result.stdout)
+    except ValueError as e:
+        print(f"Error decoding promethus response: {e}")
+        return None
+
+# string literals are skipped while matching parentheses, promethus raw strings use backticks
+STRING_RE = re.compile(r"\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*'|`[^`]*`")
+
+def matching_paren(expression, open_index):
+    """
+    Return the index of the parenthesis closing the one at open_index, or -1
+    """
+    depth = 0
+    i = open_index
+    while i < len(expression):
+        literal = STRING_RE.match(expression, i)
+        if literal:
+            i = literal.end()
+            continue
+        if expression[i] == "(":
+            depth += 1
+        elif expression[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    return -1
+
+def bucket_query(expression):
+    """
+    Strip the histogram_quantile(<q>, ...) wrapper of a profile query and
+    return the inner bucket rate expression, which must keep the le label.
+    Returns None when the wrapper is part of a larger expression, eg.
+    histogram_quantile(0.99, ...) * 1000, as the bucket rates alone would
+    not give the same result
+    """
+    match = re.match(r"\s*histogram_quantile\s*\(", expression)
+    if match is None:
+        if "histogram_quantile" in expression:
+            print(f"Error: histogram_quantile is not the outermost function of '{expression.strip()}', unable to extract its bucket query")
+            return None
+        inner = expression.strip()
+    else:
+        close = matching_paren(expression, match.end() - 1)
+        if close < 0:
+            print(f"Error: unbalanced parentheses in '{expression.strip()}'")
+            return None
+        rest = expression[close + 1:].strip()
+        if rest:
+            print(f"Error: '{rest}' follows histogram_quantile(...) in '{expression.strip()}', only a bare histogram_quantile query can be computed client side")
+            return None
+        arguments = expression[match.end():close]
+        comma = arguments.find(",")
+        if comma < 0:
+            print(f"Error: histogram_quantile in '{expression.strip()}' has no bucket argument")
+            return None
+        inner = arguments[comma + 1:].strip()
+    if not re.search(r"\ble\b", inner):
+        print(f"Warning: '{inner}' does not seem to aggregate by le, quantiles can not be computed")
+    return inner
+
+def le_value(le):
+    return float("inf") if le in ("+Inf", "Inf", "inf") else float(le)
+
+def group_buckets(series):
+    """
+    Group bucket series by their labels without le
+
+    Returns:
+        tuple: (sorted timestamp array in seconds, {group label tuple: (upper bounds, cumulative count matrix)})
+               each count matrix is shaped (buckets, timestamps), missing samples are NaN
+    """
+    grid = np.unique(series.timestamps)
+    groups = {}
+    for i in range(len(series)):
+        labels = series.labels(i)
+        le = labels.pop("le", None)
+        if le is None:
+            continue
+        key = tuple(sorted(labels.items()))
+        row = np.full(len(grid), np.nan)
+        row[np.searchsorted(grid, series.timestamps_of(i))] = series.values_of(i)
+        groups.setdefault(key, {})
+        # buckets sharing the same le (eg. 1 and 1.0) are summed like promethus
+        # coalesceBuckets does, a NaN sample counts as absent
+        bound = le_value(le)
+        if bound in groups[key]:
+            other = groups[key][bound]
+            row = np.where(np.isnan(other), row, np.where(np.isnan(row), other, other + row))
+        groups[key][bound] = row
+    res = {}
+    for key, buckets in groups.items():
+        bounds = np.array(sorted(buckets.keys()))
+        res[key] = (bounds, np.vstack([buckets[bound] for bound in bounds]))
+    return grid / 1000, res
+
+def _quantile_column(quantiles, bounds, counts):
+    # scalar path for a single timestamp where some buckets are missing,
+    # promethus simply evaluates the buckets present at that step
+    present = ~np.isnan(counts)
+    return histogram_quantiles(quantiles, bounds[present], counts[present][:, None])[:, 0]
+
+def histogram_quantiles(quantiles, bounds, counts):
+    """
+    Vectorized histogram_quantile over a whole range of timestamps
+
+    Args:
+        quantiles (array): quantiles to compute, eg. [0.5, 0.9, 0.99]
+        bounds (array): sorted bucket upper bounds, the last one must be +Inf
+        counts (array): cumulative bucket counts shaped (buckets, timestamps)
+
+    Returns:
+        array: quantile values shaped (quantiles, timestamps)
+    """
+    quantiles = np.asarray(quantiles, dtype=np.float64)
+    n_buckets, n_steps = counts.shape
+    res = np.full((len(quantiles), n_steps), np.nan)
+    if n_buckets >= 2 and np.isinf(bounds[-1]):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            res = _interpolate(quantiles, bounds, counts)
+        # steps where some bucket series has no sample are evaluated one by one
+        for step in np.flatnonzero(np.isnan(counts).any(axis=0)):
+            res[:, step] = _quantile_column(quantiles, bounds, counts[:, step])
+    res = np.where(quantiles[:, None] < 0, -np.inf, res)
+    res = np.where(quantiles[:, None] > 1, np.inf, res)
+    return np.where(np.isnan(quantiles)[:, None], np.nan, res)
+
+def _interpolate(quantiles, bounds, counts):
+    n_buckets, n_steps = counts.shape
+    # bucket counts are expected to be monotonic, rate() jitter can break that
+    counts = np.maximum.accumulate(counts, axis=0)
+    total = counts[-1]
+    rank = quantiles[:, None] * total[None, :]
+    # first bucket whose count reaches the rank, searching all but the +Inf bucket
+    b = (counts[None, :-1, :] < rank[:, None, :]).sum(axis=1)
+    steps = np.broadcast_to(np.arange(n_steps), b.shape)
+    upper = bounds[b]
+    lower = np.where(b == 0, 0.0, bounds[np.maximum(b - 1, 0)])
+    count_b = counts[b, steps]
+    count_prev = np.where(b == 0, 0.0, counts[np.maximum(b - 1, 0), steps])
+    res = lower + (upper - lower) * ((rank - count_prev) / (count_b - count_prev))
+    res = np.where(b == n_buckets - 1, bounds[-2], res)
+    res = np.where((b == 0) & (bounds[0] <= 0), bounds[0], res)
+    return np.where(total[None, :] > 0, res, np.nan)
+
+def bucket_heatmap(counts):
+    """
+    Turn cumulative bucket counts into per bucket (non cumulative) counts
+    """
+    counts = np.fmax.accumulate(np.nan_to_num(counts, nan=0.0), axis=0)
+    return np.diff(counts, axis=0, prepend=0.0)
+
+def quantile_label(q):
+    return f"p{q * 100:g}"
+
+def group_label(key):
+    return "".join([f"{name}_{value}" for name, value in key]) or "all"
+
+def format_timestamp(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+# with required=False a response without bucket series is reported and False is returned
+def process_bucket_json(json_obj, quantiles, csv_prefix, required=True):
+    series = check_meta_data(json_obj, required)
+    if series is None:
+        return False
+    timestamps, groups = group_buckets(series)
+    if len(groups) == 0:
+        if required:
+            sys_exit("no series with an le label found, please check the bucket query")
+        print("no series with an le label found, please check the bucket query")
+        return False
+    headers = ["timestamp"]
+    columns = []
+    heatmap_bounds = None
+    heatmap = None
+    for key, (bounds, counts) in groups.items():
+        values = histogram_quantiles(quantiles, bounds, counts)
+        for i, q in enumerate(quantiles):
+            headers.append(f"{group_label(key)}_{quantile_label(q)}")
+            columns.append(values[i])
+        # heatmap sums every group, groups with different bucket layouts are left out
+        if heatmap_bounds is None:
+            heatmap_bounds = bounds
+            heatmap = bucket_heatmap(counts)
+        elif np.array_equal(heatmap_bounds, bounds):
+            heatmap = heatmap + bucket_heatmap(counts)
+        else:
+            print(f"Warning: {group_label(key)} has a different bucket layout, left out of the heatmap")
+    quantile_path = f"{csv_prefix}#quantiles.csv"
+    rows = [headers]
+    for i, ts in enumerate(timestamps):
+        rows.append([format_timestamp(ts)] + ["" if np.isnan(column[i]) else column[i] for column in columns])
+    csv_write_rows(quantile_path, rows)
+    print(f"{len(columns)} quantile series saved at {quantile_path}")
+    heatmap_path = f"{csv_prefix}#heatmap.csv"
+    rows = [["timestamp"] + ["le_+Inf" if np.isinf(bound) else f"le_{bound:g}" for bound in heatmap_bounds]]
+    for i, ts in enumerate(timestamps):
+        rows.append([format_timestamp(ts)] + list(heatmap[:, i]))
+    csv_write_rows(heatmap_path, rows)
+    print(f"heatmap of {len(heatmap_bounds)} buckets saved at {heatmap_path}")
+    return True
+
+def extract_histogram_profile(profile_path, filter_expr, start, end, step, quantiles, output_dir):
+    metric_profile = read_yaml(profile_path)
+    if not metric_profile:
+        sys_exit(f"unable to load metric profile {profile_path}")
+    os.makedirs(output_dir, exist_ok=True)
+    for name, expressions in metric_profile.items():
+        # etcd_profile keeps a list of expressions per histogram, one bucket query covers all of them
+        expression = expressions[0] if isinstance(expressions, list) else expressions
+        query = bucket_query(expression.replace("$filter", filter_expr))
+        if query is None:
+            print(f"skipping {name}")
+            continue
+        print(f"executing bucket query: {name}")
+        json_obj = curl_promethus_endpoint(query, start, end, step)
+        if json_obj is None:
+            print(f"skipping {name}")
+            continue
+        json_file_path = os.path.join(output_dir, f"{name}#buckets.json")
+        with open(json_file_path, 'w') as f:
+            json.dump(json_obj, f)
+        print(f"extracted {json_file_path}")
+        # a histogram matching nothing under a narrow --filter must not stop the others
+        if not process_bucket_json(json_obj, quantiles, os.path.join(output_dir, name), required=False):
+            print(f"skipping {name}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="compute histogram quantiles and heatmaps from promethus bucket rates.")
+    parser.add_argument('-p', '--profile', type=str, help="histogram metric profile path, eg. metric_profiles/etcd_profile")
+    parser.add_argument('-j', '--json', type=str, nargs='+', help="bucket rate json files already extracted")
+    parser.add_argument('-q', '--quantiles', type=float, nargs='+', default=[0.5, 0.9, 0.99, 0.999], help="quantiles to compute")
+    parser.add_argument('-o', '--output', type=str, default=os.getcwd(), help="output directory, default current directory")
+    parser.add_argument('--filter', type=str, default="", help="label matchers substituted for $filter in the profile")
+    parser.add_argument('--start', type=str, help="window start, eg. 2025-11-20T05:08:00Z")
+    parser.add_argument('--end', type=str, help="window end, eg. 2025-11-20T07:42:59Z")
+    parser.add_argument('--step', type=str, default="30s", help="query resolution step, default 30s")
+
+    args = parser.parse_args()
+    if bool(args.profile) == bool(args.json):
+        parser.error("exactly one of --profile or --json must be passed")
+
+    if args.json:
+        for file_path in args.json:
+            json_obj = read_json_file(file_path) if file_is_readable(file_path) else None
+            if json_obj is None or not process_bucket_json(json_obj, args.quantiles, re.sub(r"(#buckets)?\.json$", "", file_path), required=False):
+                print(f"skipping {file_path}")
+    else:
+        if not args.start or not args.end:
+            parser.error("--start and --end are required with --profile")
+        extract_histogram_profile(args.profile, args.filter, unix_time(args.start), unix_time(args.end), args.step, args.quantiles, args.output)
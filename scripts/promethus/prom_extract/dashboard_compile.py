@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import json
+import argparse
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from prom_common import duration_seconds
+
+# Compile the PromQL targets of grafana dashboards (dashboard/*.json) into a
+# single metric profile that prom-extract.py can pull in one (parallel) run.
+#
+# usage:
+#   ./dashboard_compile.py -d ../../../dashboard/cnv.json ../../../dashboard/descheduler_cnv.json \
+#       --start 2025-11-20T05:08:00Z --end 2025-11-20T07:42:59Z --step 1m -o /tmp/drain/profile
+#   ./prom-extract.py -p /tmp/drain/profile -j 8
+
+def sys_exit(str):
+    print(f"{str}")
+    sys.exit(1)
+
+def file_is_readable(file_path):
+    if not os.access(file_path, os.R_OK):
+        print(f"The file at '{file_path}' is not readable")
+        return False
+    return True
+
+def read_json_file(file_path):
+    try:
+        with open(file_path, "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        print(f"Error: file '{file_path}' does not exists")
+    except IOError:
+        print(f"Error: could not open file '{file_path}'")
+
+def unix_time(date_str):
+    """
+    Convert a date string in format "YYYY-MM-DD HH:MM:SS" to Unix timestamp in UTC
+
+    Args:
+        date_str (str): Date string in format "YYYY-MM-DD HH:MM:SS"
+
+    Returns:
+        int: Unix timestamp in seconds
+    """
+    return int(datetime.fromisoformat(date_str).replace(tzinfo=timezone.utc).timestamp())
+
+# walk the panel list, rows in collapsed state keep their children in a nested "panels" list
+def iter_panels(panels):
+    for panel in panels:
+        yield panel
+        yield from iter_panels(panel.get("panels", []))
+
+def dashboard_variables(dashboard):
+    """
+    Collect the current value of every templating variable of a dashboard,
+    multi-value selections are joined as a regex alternation like grafana does
+    """
+    res = {}
+    for var in dashboard.get("templating", {}).get("list", []):
+        name = var.get("name")
+        current = var.get("current", {}).get("value")
+        if name is None or current is None:
+            continue
+        if isinstance(current, list):
+            current = [(var.get("allValue") or ".*") if value == "$__all" else value for value in current]
+            current = current[0] if len(current) == 1 else "(" + "|".join(current) + ")"
+        elif current == "$__all":
+            current = var.get("allValue") or ".*"
+        res[name] = str(current)
+    return res
+
+def format_duration(seconds):
+    # promethus durations are integers, sub second values are written in ms
+    ms = int(round(seconds * 1000))
+    return f"{ms // 1000}s" if ms % 1000 == 0 else f"{ms}ms"
+
+def builtin_variables(start, end, step, scrape_interval):
+    step_s = duration_seconds(step)
+    scrape_s = duration_seconds(scrape_interval)
+    range_s = end - start
+    return {
+        "__interval": format_duration(step_s),
+        "__interval_ms": str(int(round(step_s * 1000))),
+        # same rule grafana uses: max(interval + scrape interval, 4 * scrape interval)
+        "__rate_interval": format_duration(max(step_s + scrape_s, 4 * scrape_s)),
+        "__range": f"{range_s}s",
+        "__range_s": str(range_s),
+        "__range_ms": str(range_s * 1000),
+    }
+
+# $var, ${var}, ${var:format} and [[var]], numeric references such as $1 in label_replace are left alone
+VARIABLE_RE = re.compile(r"\$\{([A-Za-z_]\w*)(?::\w+)?\}|\[\[([A-Za-z_]\w*)\]\]|\$([A-Za-z_]\w*)")
+
+def resolve_variables(expr, variables):
+    """
+    Substitute template variables in a query expression
+
+    Returns:
+        tuple: (resolved expression, list of variable names that could not be resolved)
+    """
+    unresolved = []
+    def substitute(match):
+        name = match.group(1) or match.group(2) or match.group(3)
+        if name in variables:
+            return variables[name]
+        unresolved.append(name)
+        return match.group(0)
+    return VARIABLE_RE.sub(substitute, expr), unresolved
+
+# split on string literals so whitespace inside label matchers is never touched,
+# promethus raw strings are backtick quoted and have no escapes
+STRING_RE = re.compile(r"(\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*'|`[^`]*`)")
+
+def normalize_expr(expr):
+    """
+    Normalize a query expression so panels formatted differently in the
+    dashboard editor still de-duplicate to the same target, the result is
+    only used as a de-duplication key
+    """
+    parts = STRING_RE.split(expr)
+    for i in range(0, len(parts), 2):
+        part = re.sub(r"\s+", " ", parts[i])
+        part = re.sub(r"\s*([(){}\[\],])\s*", r"\1", part)
+        parts[i] = part
+    return "".join(parts).strip()
+
+def slugify(text):
+    return re.sub(r"[^A-Za-z0-9]+", "_", text).strip("_").lower()
+
+def target_name(panel, target):
+    title = slugify(panel.get("title") or f"panel_{panel.get('id')}")
+    visible = [t for t in panel.get("targets", []) if not t.get("hide") and (t.get("expr") or "").strip()]
+    if len(visible) <= 1:
+        return title
+    legend = target.get("legendFormat") or ""
+    suffix = slugify(legend) if legend and legend != "__auto" and "{{" not in legend else ""
+    return f"{title}_{suffix or slugify(target.get('refId', ''))}"
+
+def collect_targets(dashboard_paths, start, end, step, scrape_interval, overrides):
+    """
+    Read every dashboard and return the de-duplicated list of query targets
+
+    Returns:
+        list: dict entries with name, query and the panels the query was found in
+    """
+    targets = {}
+    names = set()
+    builtins = builtin_variables(start, end, step, scrape_interval)
+    for path in dashboard_paths:
+        if not file_is_readable(path):
+            sys_exit(f"unable to read dashboard {path}")
+        dashboard = read_json_file(path)
+        if dashboard is None or "panels" not in dashboard:
+            sys_exit(f"{path} does not look like a grafana dashboard, no panels found")
+        dashboard_title = dashboard.get("title") or os.path.basename(path)
+        variables = {**builtins, **dashboard_variables(dashboard), **overrides}
+        found = 0
+        for panel in iter_panels(dashboard["panels"]):
+            for target in panel.get("targets", []):
+                expr = (target.get("expr") or "").strip()
+                if not expr or target.get("hide"):
+                    continue
+                found += 1
+                expr, unresolved = resolve_variables(expr, variables)
+                source = f"{dashboard_title} / {panel.get('title')} ({target.get('refId')})"
+                if unresolved:
+                    print(f"skipping {source}: unresolved variables {', '.join(sorted(set(unresolved)))}, pass them with --var name=value")
+                    continue
+                key = normalize_expr(expr)
+                if key in targets:
+                    targets[key]["sources"].append(source)
+                    continue
+                name = target_name(panel, target) or "query"
+                unique_name = name
+                n = 2
+                while unique_name in names:
+                    unique_name = f"{name}_{n}"
+                    n += 1
+                names.add(unique_name)
+                # the first resolved expression is kept as written in the dashboard
+                targets[key] = {"name": unique_name, "query": expr, "sources": [source]}
+        print(f"{path}: {found} targets found")
+    return list(targets.values())
+
+def compile_profile(targets, start, end, step):
+    metrics = []
+    for target in targets:
+        metrics.append({
+            "name": target["name"],
+            "description": "; ".join(target["sources"]),
+            "query": target["query"],
+            "start": None,
+            "end": None,
+            "step": None
+        })
+    return {
+        "metrics": metrics,
+        "global_config": {
+            "start": start,
+            "end": end,
+            "step": step
+        }
+    }
+
+def parse_overrides(var_args):
+    res = {}
+    for item in var_args or []:
+        if "=" not in item:
+            sys_exit(f"invalid --var '{item}', expecting name=value")
+        name, value = item.split("=", 1)
+        res[name] = value
+    return res
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="compile grafana dashboards into a single prom-extract metric profile.")
+    parser.add_argument('-d', '--dashboard', type=str, nargs='+', required=True, help="grafana dashboard json file paths")
+    parser.add_argument('-o', '--output', type=str, required=True, help="metric profile output path, csv files are extracted next to it")
+    parser.add_argument('--start', type=str, required=True, help="window start, eg. 2025-11-20T05:08:00Z")
+    parser.add_argument('--end', type=str, required=True, help="window end, eg. 2025-11-20T07:42:59Z")
+    parser.add_argument('--step', type=str, default="1m", help="query resolution step, default 1m")
+    parser.add_argument('--scrape-interval', type=str, default="30s", help="promethus scrape interval used to resolve $__rate_interval, default 30s")
+    parser.add_argument('--var', type=str, action='append', help="template variable override name=value, can be repeated")
+
+    args = parser.parse_args()
+    try:
+        start = unix_time(args.start)
+        end = unix_time(args.end)
+    except ValueError as e:
+        sys_exit(f"Error: {e}")
+    if end <= start:
+        sys_exit("end time stamp is before start time stamp")
+
+    targets = collect_targets(args.dashboard, start, end, args.step, args.scrape_interval, parse_overrides(args.var))
+    if len(targets) == 0:
+        sys_exit("no query targets found in the given dashboards")
+    profile = compile_profile(targets, args.start, args.end, args.step)
+    output_dir = os.path.dirname(args.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(profile, f, indent=2)
+    print(f"{len(targets)} unique queries saved at {args.output}")
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import csv
+import sys
+import json
+import glob
+import argparse
+import numpy as np
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from prom_common import duration_seconds
+
+# Slice wide per-node metric csv files (grafana exports such as
+# data/node-drain-cpu-only/IO pressure by Node.csv: a Time column followed by one
+# column per node) around per-node event windows, and compute before/during/after
+# aggregates for every (node, window) pair in one vectorized pass.
+#
+# Event windows come from one of:
+#   --vmim     a vmim backup directory written by data/vmim.sh, windows are the
+#              migrations grouped by status.migrationState.sourceNode, a node
+#              drained several times gets one window per burst of migrations
+#   --mcp-log  scripts/node/mcp-upgrade.log, the pool level start/end time is
+#              applied to every node column
+#   --windows  a csv file with node,start,end[,label] rows, node may be * for all nodes
+#
+# usage:
+#   ./event_window.py -c "../../../data/node-drain-cpu-only/IO pressure by Node.csv" \
+#       --vmim ../../../data/vmim_backups_20251121_165631 --csv-utc-offset=-06:00 --pad 10m
+
+def sys_exit(str):
+    print(f"{str}")
+    sys.exit(1)
+
+def is_dir(dir_path):
+    if not os.path.isdir(dir_path):
+        print(f"The directory '{dir_path}' does not exits")
+        return False
+    return True
+
+def file_is_readable(file_path):
+    if not os.access(file_path, os.R_OK):
+        print(f"The file at '{file_path}' is not readable")
+        return False
+    return True
+
+def read_json_file(file_path):
+    try:
+        with open(file_path, "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        print(f"Error: file '{file_path}' does not exists")
+    except IOError:
+        print(f"Error: could not open file '{file_path}'")
+
+def utc_offset(offset):
+    match = re.fullmatch(r"([+-])(\d{1,2}):?(\d{2})?", offset)
+    if not match:
+        sys_exit(f"invalid utc offset '{offset}', expecting a format like -06:00 or +09:00")
+    sign = -1 if match.group(1) == "-" else 1
+    return timezone(sign * timedelta(hours=int(match.group(2)), minutes=int(match.group(3) or 0)))
+
+def parse_time(time_str, tz=timezone.utc):
+    """
+    Parse an RFC3339 timestamp or a grafana "YYYY-MM-DD HH:MM:SS" time to a unix timestamp,
+    times without a zone are interpreted in tz
+    """
+    time_str = time_str.strip()
+    if re.fullmatch(r"\d{10}", time_str):
+        return int(time_str)
+    parsed = datetime.fromisoformat(time_str.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=tz)
+    return int(parsed.timestamp())
+
+def format_time(ts):
+    return datetime.fromtimestamp(int(ts), tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def parse_value(value):
+    value = value.strip()
+    if value == "":
+        return np.nan
+    # grafana exports percent units as "12.3%"
+    if value.endswith("%"):
+        return float(value[:-1]) / 100
+    return float(value)
+
+def read_wide_csv(file_path, tz):
+    """
+    Read a grafana wide csv export
+
+    Returns:
+        tuple: (int64 unix timestamps, column names, float64 matrix shaped (timestamps, columns))
+    """
+    with open(file_path, "r", encoding="utf-8-sig") as file:
+        rows = list(csv.reader(file))
+    # the "full" grafana export starts with an excel sep=, hint
+    if rows and rows[0] and rows[0][0].startswith("sep="):
+        rows = rows[1:]
+    if len(rows) < 2:
+        sys_exit(f"no data found in {file_path}")
+    columns = rows[0][1:]
+    rows = [row for row in rows[1:] if row and row[0].strip()]
+    timestamps = np.array([parse_time(row[0], tz) for row in rows], dtype=np.int64)
+    values = np.array([[parse_value(value) for value in row[1:len(columns) + 1]] for row in rows], dtype=np.float64)
+    order = np.argsort(timestamps, kind="stable")
+    return timestamps[order], columns, values[order]
+
+def vmim_windows(vmim_dir, group, gap):
+    """
+    Build event windows from a vmim backup directory, with group "node" the
+    migrations of a source node are split into separate drains wherever the
+    node was idle for more than gap seconds
+
+    Returns:
+        list: (node, start, end, label) tuples
+    """
+    if not is_dir(vmim_dir):
+        sys_exit(f"{vmim_dir} is not recognized as a directory")
+    migrations = []
+    for file_path in glob.glob(f"{vmim_dir}/**/*.json", recursive=True):
+        vmim = read_json_file(file_path)
+        state = (vmim or {}).get("status", {}).get("migrationState", {})
+        if not state.get("sourceNode") or not state.get("startTimestamp") or not state.get("endTimestamp"):
+            continue
+        migrations.append((state["sourceNode"], parse_time(state["startTimestamp"]), parse_time(state["endTimestamp"]),
+                           f"{vmim['metadata']['namespace']}/{vmim['metadata']['name']}"))
+    print(f"{len(migrations)} completed migrations found in {vmim_dir}")
+    if group == "migration":
+        return migrations
+    by_node = {}
+    for node, start, end, _ in migrations:
+        by_node.setdefault(node, []).append((start, end))
+    windows = []
+    for node, spans in sorted(by_node.items()):
+        drains = []
+        for start, end in sorted(spans):
+            if drains and start - drains[-1][1] <= gap:
+                first, last, count = drains[-1]
+                drains[-1] = (first, max(last, end), count + 1)
+            else:
+                drains.append((start, end, 1))
+        windows += [(node, start, end, f"drain#{k}({count} migrations)") for k, (start, end, count) in enumerate(drains, 1)]
+    return windows
+
+# zone abbreviations printed by date(1) in the tracker log lines
+LOG_ZONES = {"UTC": 0, "GMT": 0, "JST": 9, "IST": 5.5, "CET": 1, "CEST": 2,
+             "EST": -5, "EDT": -4, "CST": -6, "CDT": -5, "PST": -8, "PDT": -7}
+
+def parse_log_time(time_str):
+    # eg. "Thu Nov 13 03:03:58 PM JST 2025"
+    parts = time_str.split()
+    if len(parts) != 7 or parts[5] not in LOG_ZONES:
+        sys_exit(f"unable to parse log time '{time_str}', please pass the windows with --windows")
+    parsed = datetime.strptime(" ".join(parts[:5] + parts[6:]), "%a %b %d %I:%M:%S %p %Y")
+    return int(parsed.replace(tzinfo=timezone(timedelta(hours=LOG_ZONES[parts[5]]))).timestamp())
+
+def mcp_log_windows(log_path):
+    """
+    Build the upgrade window from a log written by scripts/node/mcp-tracker.sh,
+    the log has no per-node information so the window applies to every node.
+    The window spans the recorded Start/End Time fields and every progress line
+    """
+    if not file_is_readable(log_path):
+        sys_exit(f"unable to read {log_path}")
+    with open(log_path, "r", errors="replace") as file:
+        content = file.read()
+    starts = [parse_time(ts) for ts in re.findall(r"Start Time:[ \t]*(\d{4}-\d{2}-\d{2}T\S+)", content)]
+    ends = [parse_time(ts) for ts in re.findall(r"End Time:[ \t]*(\d{4}-\d{2}-\d{2}T\S+)", content)]
+    progress = [parse_log_time(ts) for ts in re.findall(r"^\[([^\]]+)\] (?:Progress|UPGRADE COMPLETED)", content, re.MULTILINE)]
+    if len(starts + progress) == 0 or len(ends + progress) == 0:
+        sys_exit(f"no start and end time found in {log_path}")
+    start = min(starts + progress)
+    end = max(ends + progress)
+    if end <= start:
+        sys_exit(f"end time found in {log_path} is before its start time")
+    return [("*", start, end, "mcp-upgrade")]
+
+def csv_windows(file_path):
+    windows = []
+    if not file_is_readable(file_path):
+        sys_exit(f"unable to read {file_path}")
+    with open(file_path, "r") as file:
+        for row in csv.reader(file):
+            if not row or row[0].strip().startswith("#") or row[0].strip() == "node":
+                continue
+            if len(row) < 3:
+                sys_exit(f"invalid window {row}, expecting node,start,end[,label]")
+            label = row[3].strip() if len(row) > 3 else ""
+            windows.append((row[0].strip(), parse_time(row[1]), parse_time(row[2]), label))
+    return windows
+
+def column_major(values, present, fill):
+    """
+    Flatten the values column by column with missing samples set to fill, one
+    extra fill row per column keeps a range ending at the last row addressable
+    """
+    flat = np.full((values.shape[1], values.shape[0] + 1), fill)
+    flat[:, :-1] = np.where(present, values, fill).T
+    return flat.ravel()
+
+def range_reduce(flat, rows, reduce, lo, hi, columns, empty):
+    """
+    reduce() of rows [lo, hi) of every (lo, hi, column) query with a single
+    reduceat call, empty ranges give NaN. Queries are visited in flat order
+    so the gaps reduceat also walks between two queries add up to at most
+    one pass over the data
+    """
+    first = columns * rows + lo
+    order = np.argsort(first, kind="stable")
+    bounds = np.empty(2 * len(lo), dtype=np.int64)
+    bounds[0::2] = first[order]
+    bounds[1::2] = (columns * rows + hi)[order]
+    res = np.empty(len(lo))
+    res[order] = reduce.reduceat(flat, bounds)[0::2]
+    return np.where((hi <= lo) | (res == empty), np.nan, res)
+
+def window_aggregates(timestamps, values, windows, pad):
+    """
+    Compute before/during/after aggregates of every window
+
+    Args:
+        timestamps (array): sorted int64 unix timestamps
+        values (array): float64 matrix shaped (timestamps, columns)
+        windows (tuple): (column index array, start array, end array)
+        pad (int): seconds before the start and after the end making up the before/after phases
+
+    Returns:
+        dict: aggregate name -> array with one value per window
+    """
+    columns, start, end = windows
+    present = ~np.isnan(values)
+    # prefix sums turn every mean into two lookups, whatever the number of windows
+    sums = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(np.where(present, values, 0.0), axis=0)])
+    counts = np.vstack([np.zeros((1, values.shape[1]), dtype=np.int64), np.cumsum(present, axis=0)])
+    # column major copies instead of per level lookup tables, memory stays at the size of the csv
+    rows = values.shape[0] + 1
+    max_flat = column_major(values, present, -np.inf)
+    min_flat = column_major(values, present, np.inf)
+    phases = {
+        "before": (start - pad, start),
+        "during": (start, end + 1),
+        "after": (end + 1, end + 1 + pad),
+    }
+    res = {}
+    for phase, (phase_start, phase_end) in phases.items():
+        lo = np.searchsorted(timestamps, phase_start, side="left")
+        hi = np.searchsorted(timestamps, phase_end, side="left")
+        n = counts[hi, columns] - counts[lo, columns]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            res[f"{phase}_mean"] = np.where(n > 0, (sums[hi, columns] - sums[lo, columns]) / n, np.nan)
+        res[f"{phase}_max"] = range_reduce(max_flat, rows, np.maximum, lo, hi, columns, -np.inf)
+        res[f"{phase}_min"] = range_reduce(min_flat, rows, np.minimum, lo, hi, columns, np.inf)
+        res[f"{phase}_samples"] = n
+    res["during_vs_before"] = res["during_mean"] - res["before_mean"]
+    res["after_vs_before"] = res["after_mean"] - res["before_mean"]
+    return res
+
+def resolve_windows(windows, columns):
+    """
+    Map window node names to csv column indexes, * expands to every column
+    """
+    index = {name: i for i, name in enumerate(columns)}
+    column_idx, starts, ends, nodes, labels = [], [], [], [], []
+    missing = set()
+    for node, start, end, label in windows:
+        targets = list(index.items()) if node == "*" else [(node, index.get(node))]
+        for name, i in targets:
+            if i is None:
+                missing.add(name)
+                continue
+            column_idx.append(i)
+            starts.append(start)
+            ends.append(end)
+            nodes.append(name)
+            labels.append(label)
+    if missing:
+        print(f"Warning: {len(missing)} nodes have no column in the csv file: {', '.join(sorted(missing))}")
+    return (np.array(column_idx, dtype=np.int64), np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)), nodes, labels
+
+def slice_csv(file_path, windows, pad, tz, output_dir):
+    timestamps, columns, values = read_wide_csv(file_path, tz)
+    resolved, nodes, labels = resolve_windows(windows, columns)
+    if len(nodes) == 0:
+        print(f"no window matches a column of {file_path}, skipping")
+        return
+    aggregates = window_aggregates(timestamps, values, resolved, pad)
+    out_name = re.sub(r"\.csv$", "", os.path.basename(file_path)) + "#windows.csv"
+    out_path = os.path.join(output_dir or os.path.dirname(file_path), out_name)
+    names = list(aggregates.keys())
+    with open(out_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["node", "window", "start", "end"] + names)
+        for i in range(len(nodes)):
+            writer.writerow([nodes[i], labels[i], format_time(resolved[1][i]), format_time(resolved[2][i])] +
+                            ["" if np.isnan(aggregates[name][i]) else aggregates[name][i] for name in names])
+    print(f"{len(nodes)} windows over {len(columns)} nodes saved at {out_path}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="before/during/after aggregates of per-node metrics around event windows.")
+    parser.add_argument('-c', '--csv', type=str, nargs='+', required=True, help="wide per-node csv files, Time column followed by node columns")
+    parser.add_argument('--vmim', type=str, help="vmim backup directory written by data/vmim.sh")
+    parser.add_argument('--group', type=str, choices=["node", "migration"], default="node", help="with --vmim, one window per drained node or per migration")
+    parser.add_argument('--mcp-log', type=str, help="mcp-upgrade.log written by scripts/node/mcp-tracker.sh")
+    parser.add_argument('--windows', type=str, help="csv file with node,start,end[,label] rows")
+    parser.add_argument('--pad', type=str, default="10m", help="length of the before and after phases, default 10m")
+    parser.add_argument('--gap', type=str, help="with --vmim --group node, idle time between migrations of a node that starts a new drain window, default --pad")
+    parser.add_argument('--csv-utc-offset', type=str, default="+00:00", help="utc offset of the csv Time column, eg. --csv-utc-offset=-06:00")
+    parser.add_argument('-o', '--output', type=str, help="output directory, default next to each csv file")
+
+    args = parser.parse_args()
+    if sum(bool(source) for source in [args.vmim, args.mcp_log, args.windows]) != 1:
+        parser.error("exactly one of --vmim, --mcp-log or --windows must be passed")
+
+    pad = duration_seconds(args.pad)
+    if args.vmim:
+        windows = vmim_windows(args.vmim, args.group, duration_seconds(args.gap) if args.gap else pad)
+    elif args.mcp_log:
+        windows = mcp_log_windows(args.mcp_log)
+    else:
+        windows = csv_windows(args.windows)
+    if len(windows) == 0:
+        sys_exit("no event windows found")
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    for file_path in args.csv:
+        if file_is_readable(file_path):
+            slice_csv(file_path, windows, pad, utc_offset(args.csv_utc_offset), args.output)
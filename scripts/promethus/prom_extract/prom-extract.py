@@ -9,8 +9,15 @@ import sys
 import argparse
 import yaml
 import subprocess
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from prom_series import SeriesSet, format_timestamp
+from prom_common import duration_seconds
+
 # Python scripts process promethus JSON raw metrics
 
 def sys_exit(str):
@@ -47,23 +54,30 @@ def file_is_readable(file_path):
 def obj_exist(obj):
     return obj is not None
 
-def check_meta_data(json_obj):
+# validate a promethus response and convert its result into a SeriesSet,
+# with required=False an error status or an empty result returns None instead of exiting
+def check_meta_data(json_obj, required=True):
     status = json_obj.get("status")
     if obj_exist(status) and status == "success":
         print("Promethus query status returned success")
     else:
-        sys_exit("Promethus query status returned non-success or status value is not present")
-    data = json_obj.get("data")
+        message = f"Promethus query status returned non-success or status value is not present: {json_obj.get('error')}"
+        if required:
+            sys_exit(message)
+        print(message)
+        return None
+    data = json_obj.get("data") or {}
     res_type = data.get("resultType")
     res = data.get("result")
-    empty_metric = 0
-    if obj_exist(data) and obj_exist(res_type) and obj_exist(res) and len(res) >= 1:
-        for item in res:
-            if len(item['metric']) == 0:
-                empty_metric += 1
-        print(f"total of {len(res)} entries of data found, {empty_metric} entires without metric name, resultType: {res_type}")
-    else:
+    if obj_exist(res_type) and obj_exist(res) and len(res) >= 1:
+        series = SeriesSet.from_json(res, release=True)
+        empty_metric = sum(1 for i in range(len(series)) if series.is_empty(i))
+        print(f"total of {len(series)} entries of data found, {empty_metric} entires without metric name, resultType: {res_type}")
+        return series
+    if required:
         sys_exit("No data found, please check your json file")
+    print("No data found")
+    return None
 
 # read the path of json files with given directory
 def read_json_files(dir_path):
@@ -112,45 +126,49 @@ def csv_write_row(path, row):
         print(f"Error: '{e}' occured while writing data into '{path}'")
 
 
-# structure a raw json object 
+# structure a raw json object, values are plain float lists as before
 def process_raw_json_obj(json_obj):
     res = {}
-    result = json_obj['data']["result"]
-    for item in result:
-        res[list(item['metric'].keys())[0]] = [float(value[1]) for value in item['values']]
+    series = SeriesSet.from_json(json_obj)
+    for i in range(len(series)):
+        res[series.label_sets[i][0][0]] = series.values_of(i).tolist()
     return res
 
-def json_to_csv(file_path):
-    if file_is_readable(file_path):
-        json_obj = read_json_file(file_path)
-    check_meta_data(json_obj)
-    result = json_obj['data']["result"]
+# returns False when required is False and the json file holds no data to convert
+def json_to_csv(file_path, required=True):
+    json_obj = read_json_file(file_path) if file_is_readable(file_path) else None
+    if json_obj is None:
+        if required:
+            sys_exit(f"unable to read {file_path}")
+        return False
+    series = check_meta_data(json_obj, required)
+    del json_obj
+    if series is None:
+        return False
     csv_file_path=re.sub(r"\.json$", ".csv", file_path)
     filename = re.search(r'[^/\\]+(?=\.[^.]+$)', file_path).group(0)
     data_points = {}
-    for item in result:
-        if len(item['metric']) == 0:
-            header = filename
-        else:
-            header = "".join([f"{key}_{value}" for key, value in item['metric'].items()])
-    
-        values = []
-        values = [float(value[1]) for value in item['values']]
-        non_zero_values = [value for value in values if value != float(0)]
-        if len(non_zero_values) != len(values) or len(non_zero_values) == 0:
-            print(f"found zero value: {header}, non-zero values/zero values count{len(values)}/{len(non_zero_values)}")
+    for i in range(len(series)):
+        header = filename if series.is_empty(i) else series.header(i)
+        values = series.values_of(i)
+        non_zero_count = int(np.count_nonzero(values))
+        if non_zero_count != len(values) or non_zero_count == 0:
+            print(f"found zero value: {header}, non-zero values/zero values count{len(values)}/{non_zero_count}")
         data_points[header] = values
         
     headers = list(data_points.keys())
-    csv_write_row(csv_file_path, headers)
-    max_length = max(len(values) for values in data_points.values())
-    for i in range(max_length):
-        row = []
-        for header in headers:
-            values = data_points[header]
-            row.append(values[i] if i < len(values) else "")
-        csv_write_row(csv_file_path, row)
+    columns = list(data_points.values())
+    max_length = max(len(values) for values in columns)
+    # one open file for the whole table instead of one per row
+    try:
+        with open(csv_file_path, mode='a', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(headers)
+            writer.writerows([values[i] if i < len(values) else "" for values in columns] for i in range(max_length))
+    except Exception as e:
+        print(f"Error: '{e}' occured while writing data into '{csv_file_path}'")
     print(f"csv file saved at {csv_file_path}")
+    return True
     
 def is_int(num):
     try:
@@ -187,8 +205,7 @@ def validate_metric_profile(metric_profile):
             return False 
     return True
 
-def curl_promethus_endpoint(query_name, start, end, step, query_expression, output_dir=None):
-    print(f"executing query: {query_name}")
+def query_promethus_range(start, end, step, query_expression):
     urlencode_cmd = ["urlencode", query_expression]
     encoded_url = subprocess.run(urlencode_cmd, capture_output=True, text="True")
     encoded_expr = encoded_url.stdout.replace('\n', '').replace('\r', '')
@@ -200,11 +217,18 @@ def curl_promethus_endpoint(query_name, start, end, step, query_expression, outp
     query_result = subprocess.run(curl_cmd, capture_output=True, shell=True, text=True)
     if query_result.returncode != 0:
         print(f"Error executing query: {query_result.stderr}")
+        return None
+    return query_result.stdout
+
+def curl_promethus_endpoint(query_name, start, end, step, query_expression, output_dir=None):
+    print(f"executing query: {query_name}")
+    query_output = query_promethus_range(start, end, step, query_expression)
+    if query_output is None:
         return False
     
     # Process the JSON output with jq and write to file on host
     jq_cmd = ["jq", "."]
-    jq_process = subprocess.run(jq_cmd, input=query_result.stdout, capture_output=True, text=True)
+    jq_process = subprocess.run(jq_cmd, input=query_output, capture_output=True, text=True)
     if jq_process.returncode != 0:
         print(f"Error processing JSON with jq: {jq_process.stderr}")
         return False
@@ -228,26 +252,275 @@ def curl_promethus_endpoint(query_name, start, end, step, query_expression, outp
     
     return f"{query_name}.json"
 
-def extract_prom_json_data(metric_file_path):
+def extract_metric(metric, global_config, output_dir):
+    query_name = metric['name']
+    query_expression = metric['query']
+    start = unix_time(metric.get('start') if metric.get('start') is not None else global_config.get('start'))
+    end = unix_time(metric.get('end') if metric.get('end') is not None else global_config.get('end'))
+    step = metric.get('step') if metric.get('step') is not None else global_config.get('step')
+    json_file_name = curl_promethus_endpoint(query_name, start, end, step, query_expression, output_dir)
+    if not json_file_name:
+        print(f"skipping csv conversion of {query_name}")
+        return
+    file_path = os.path.join(output_dir, json_file_name)
+    # threshold queries such as "... > 0.01" are usually empty by design,
+    # skip them instead of ending the whole pull
+    if not json_to_csv(file_path, required=False):
+        print(f"skipping csv conversion of {query_name}")
+
+# jobs > 1 runs the profile queries concurrently, each query writes its own json/csv pair
+def extract_prom_json_data(metric_file_path, jobs=1):
      metric_profile = read_json_file(metric_file_path)
-     validate_metric_profile(metric_profile)
+     if not validate_metric_profile(metric_profile):
+         sys_exit(f"invalid metric profile {metric_file_path}")
      output_dir = os.path.dirname(metric_file_path)
-     for metric in metric_profile['metrics']:
-         query_name = metric['name']
-         query_expression = metric['query']
-         start = unix_time(metric.get('start') if metric.get('start') is not None else metric_profile['global_config'].get('start'))
-         end = unix_time(metric.get('end') if metric.get('end') is not None else metric_profile['global_config'].get('end'))
-         step = metric.get('step') if metric.get('step') is not None else metric_profile['global_config'].get('step')
-         json_file_name = curl_promethus_endpoint(query_name, start, end, step, query_expression, output_dir)
-         file_path = os.path.join(output_dir, json_file_name)
-         json_to_csv(file_path)
+     global_config = metric_profile['global_config']
+     if jobs <= 1:
+         for metric in metric_profile['metrics']:
+             extract_metric(metric, global_config, output_dir)
+         return
+     with ThreadPoolExecutor(max_workers=jobs) as executor:
+         futures = [executor.submit(extract_metric, metric, global_config, output_dir) for metric in metric_profile['metrics']]
+         for future in futures:
+             future.result()
      
-# if __name__ == '__main__':
-#     parser = argparse.ArgumentParser(description="command line options for promethus data processing.")
-#     parser.add_argument('-p', '--profile', type=str, help="promethus metric profile path")
-    
-#     args = parser.parse_args()
-#     if args.profile:
-#         extract_prom_json_data(metric_profile)
+def read_follow_state(state_path):
+    if not os.path.exists(state_path):
+        return {}
+    state = read_json_file(state_path)
+    return state if state is not None else {}
+
+def write_follow_state(state_path, state):
+    # write then rename so an interrupted run never leaves a truncated state file
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+def truncate_partial_row(csv_path):
+    """
+    Cut a follow csv file back to its last newline, a run killed mid write can
+    leave a partial row such as "1700000060,0." the next append would extend
+    """
+    if not os.path.exists(csv_path):
+        return
+    with open(csv_path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # walk back block by block until a newline, or the start of the file
+        end = size
+        while end > 0:
+            block_start = max(end - 65536, 0)
+            f.seek(block_start)
+            newline = f.read(end - block_start).rfind(b"\n")
+            if newline >= 0:
+                end = block_start + newline + 1
+                break
+            end = block_start
+        f.truncate(end)
+    print(f"Warning: dropped a partially written row at the end of {csv_path}")
 
-extract_prom_json_data("/home/guoqingli/work/ocp-workspace/scripts/promethus/metric_profiles/desche_cpu_utilization_profile")
\ No newline at end of file
+def csv_last_timestamp(csv_path):
+    """
+    Return the timestamp of the last complete row of a follow csv file, the
+    csv is the source of truth when the state file lags behind a crash.
+    Expects partial rows to be removed by truncate_partial_row first
+    """
+    if not os.path.exists(csv_path):
+        return None
+    with open(csv_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - 65536, 0))
+        lines = f.read().decode(errors="replace").splitlines()
+    for line in reversed(lines):
+        first = line.split(",", 1)[0]
+        try:
+            return float(first)
+        except ValueError:
+            continue
+    return None
+
+def series_header(series, i, query_name):
+    return query_name if series.is_empty(i) else series.header(i)
+
+def follow_csv_path(output_dir, query_name, part):
+    name = f"{query_name}-follow.csv" if part == 0 else f"{query_name}-follow.{part}.csv"
+    return os.path.join(output_dir, name)
+
+def follow_csv_parts(output_dir, query_name):
+    """
+    Return the sorted part numbers of the follow csv files of a query,
+    part 0 is <name>-follow.csv and part N is <name>-follow.N.csv
+    """
+    parts = [0] if os.path.exists(follow_csv_path(output_dir, query_name, 0)) else []
+    for path in glob.glob(os.path.join(glob.escape(output_dir), f"{glob.escape(query_name)}-follow.*.csv")):
+        match = re.fullmatch(rf"{re.escape(query_name)}-follow\.(\d+)\.csv", os.path.basename(path))
+        if match:
+            parts.append(int(match.group(1)))
+    return sorted(parts)
+
+# promethus rejects range queries resolving to more than 11000 points
+MAX_POINTS_PER_QUERY = 10000
+
+def follow_metric(metric, global_config, output_dir, state, now, lag):
+    """
+    Pull the samples of one metric that are newer than the last stored timestamp
+    and append them to <name>-follow.csv. Columns can not be added to a csv
+    file without rewriting it, so when new series show up, eg. the virt-launcher
+    pod of a migrated vm, the pull continues in <name>-follow.N.csv with the
+    previous columns plus the new ones
+
+    Returns:
+        int: number of rows appended
+    """
+    query_name = metric['name']
+    step = metric.get('step') if metric.get('step') is not None else global_config.get('step')
+    step_s = duration_seconds(step)
+    start = unix_time(metric.get('start') if metric.get('start') is not None else global_config.get('start'))
+    end_value = metric.get('end') if metric.get('end') is not None else global_config.get('end')
+    metric_state = state.setdefault(query_name, {})
+    parts = follow_csv_parts(output_dir, query_name)
+    if parts:
+        # only the newest part is ever appended to
+        truncate_partial_row(follow_csv_path(output_dir, query_name, parts[-1]))
+    written = [part for part in parts if os.path.getsize(follow_csv_path(output_dir, query_name, part)) > 0]
+    if metric_state.get('columns') is not None and not written:
+        # the csv files were removed to restart the pull, start over with a fresh header
+        print(f"no follow csv file of {query_name} found, restarting it from the profile start time")
+        metric_state.clear()
+    part = written[-1] if written else (parts[-1] if parts else 0)
+    csv_path = follow_csv_path(output_dir, query_name, part)
+    # adopt the header on restart, or when the state file lags behind a newer part
+    if written and (metric_state.get('columns') is None or metric_state.get('part', 0) != part):
+        header = next(read_csv_file(csv_path), [])
+        if len(header) == 0 or header[0] != "timestamp":
+            sys_exit(f"{csv_path} exists but was not written by follow mode, please move it away")
+        metric_state['columns'] = header[1:]
+    metric_state['part'] = part
+    last_csv_timestamp = None
+    for written_part in reversed(written):
+        last_csv_timestamp = csv_last_timestamp(follow_csv_path(output_dir, query_name, written_part))
+        if last_csv_timestamp is not None:
+            break
+    # the csv may be ahead of the state file if the previous run was killed mid poll
+    stored = [ts for ts in [last_csv_timestamp, metric_state.get('last_timestamp')] if ts is not None]
+    if stored:
+        # keep the evaluation grid of the previous pulls
+        start = max(stored) + step_s
+    end = now - lag if end_value is None else min(now - lag, unix_time(end_value))
+    # only evaluate complete steps so every appended row is final
+    end = start + ((end - start) // step_s) * step_s
+    if end < start:
+        return 0
+    appended = 0
+    while start <= end:
+        chunk_end = min(end, start + (MAX_POINTS_PER_QUERY - 1) * step_s)
+        query_output = query_promethus_range(format_timestamp(start * 1000), format_timestamp(chunk_end * 1000), step, metric['query'])
+        if query_output is None:
+            break
+        try:
+            json_obj = json.loads(query_output)
+        except ValueError as e:
+            print(f"Error decoding promethus response of {query_name}: {e}")
+            break
+        if json_obj.get("status") != "success":
+            print(f"Promethus query {query_name} returned {json_obj.get('status')}: {json_obj.get('error')}")
+            break
+        series = SeriesSet.from_json(json_obj, release=True)
+        del json_obj
+        headers = [series_header(series, i, query_name) for i in range(len(series))]
+        columns = metric_state.get('columns')
+        if columns is None and len(series) > 0:
+            columns = list(dict.fromkeys(headers))
+            metric_state['columns'] = columns
+        elif columns is not None:
+            known = set(columns)
+            new = [header for header in dict.fromkeys(headers) if header not in known]
+            if new:
+                metric_state['part'] += 1
+                columns = columns + new
+                metric_state['columns'] = columns
+                csv_path = follow_csv_path(output_dir, query_name, metric_state['part'])
+                print(f"{len(new)} new series of {query_name}, continuing in {csv_path}")
+        if columns is not None and (not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0):
+            csv_write_row(csv_path, ["timestamp"] + columns)
+        index = {header: i for i, header in enumerate(columns or [])}
+        grid, matrix, present = series.aligned()
+        table = np.full((len(grid), len(index)), np.nan)
+        # a separate mask keeps missing samples apart from NaN samples
+        sampled = np.zeros((len(grid), len(index)), dtype=bool)
+        for i, header in enumerate(headers):
+            table[:, index[header]] = matrix[:, i]
+            sampled[:, index[header]] = present[:, i]
+        rows = sampled.any(axis=1)
+        grid, table, sampled = grid[rows], table[rows], sampled[rows]
+        if len(grid) > 0:
+            with open(csv_path, mode='a', newline='') as file:
+                writer = csv.writer(file)
+                for ts, row, mask in zip(grid, table, sampled):
+                    # NaN samples are written the way promethus returns them
+                    writer.writerow([format_timestamp(ts)] + [("NaN" if np.isnan(value) else value) if found else ""
+                                                              for value, found in zip(row, mask)])
+                file.flush()
+                os.fsync(file.fileno())
+            appended += len(grid)
+        metric_state['last_timestamp'] = chunk_end
+        start = chunk_end + step_s
+    return appended
+
+def follow_prom_json_data(metric_file_path, lag="1m", jobs=1):
+    """
+    Keep polling every profile query for samples after the last stored timestamp
+    until the profile end time, or forever when no end time is set
+    """
+    metric_profile = read_json_file(metric_file_path)
+    if not validate_metric_profile(metric_profile):
+        sys_exit(f"invalid metric profile {metric_file_path}")
+    output_dir = os.path.dirname(metric_file_path)
+    global_config = metric_profile['global_config']
+    metrics = metric_profile['metrics']
+    state_path = os.path.join(output_dir, ".follow_state.json")
+    state = read_follow_state(state_path)
+    lag_s = duration_seconds(lag)
+    steps = [duration_seconds(metric.get('step') if metric.get('step') is not None else global_config.get('step')) for metric in metrics]
+    ends = [metric.get('end') if metric.get('end') is not None else global_config.get('end') for metric in metrics]
+    # poll as often as the finest step produces a new point, back off while nothing new arrives
+    base_interval = min(steps)
+    interval = base_interval
+    print(f"following {len(metrics)} queries, state kept at {state_path}, ctrl-c to stop")
+    try:
+        while True:
+            now = time.time()
+            with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+                counts = list(executor.map(lambda metric: follow_metric(metric, global_config, output_dir, state, now, lag_s), metrics))
+            write_follow_state(state_path, state)
+            appended = sum(counts)
+            if appended > 0:
+                print(f"[{datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}] appended {appended} rows")
+            if all(end is not None and state[metric['name']].get('last_timestamp', float('-inf')) + step > unix_time(end)
+                   for metric, end, step in zip(metrics, ends, steps)):
+                print("reached the profile end time")
+                return
+            interval = base_interval if appended > 0 else min(interval * 2, base_interval * 4)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        write_follow_state(state_path, state)
+        print(f"stopped, state saved at {state_path}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="command line options for promethus data processing.")
+    parser.add_argument('-p', '--profile', type=str, required=True, help="promethus metric profile path")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="number of queries to run in parallel")
+    parser.add_argument('-f', '--follow', action='store_true', help="keep appending new samples to <name>-follow.csv until the profile end time, new series continue in <name>-follow.N.csv")
+    parser.add_argument('--lag', type=str, default="1m", help="with --follow, stay this far behind now so appended points are final, default 1m")
+
+    args = parser.parse_args()
+    if args.follow:
+        follow_prom_json_data(args.profile, args.lag, args.jobs)
+    else:
+        extract_prom_json_data(args.profile, args.jobs)
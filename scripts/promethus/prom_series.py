@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import sys
+import numpy as np
+
+# Compact in-memory representation of promethus query results shared by
+# prom_py and prom_extract/*.
+#
+# The decoded json keeps every sample as a [timestamp, "value"] list, which costs
+# well over 100 bytes per sample. SeriesSet keeps all samples of a result in two
+# contiguous buffers, int64 millisecond timestamps and float64 values (16 bytes
+# per sample), with per series offsets into them. Label sets are interned so
+# identical label names, values and whole label sets are stored once.
+
+_label_sets = {}
+
+def intern_labels(metric):
+    """
+    Return the shared (name, value) tuple for a promethus label dict, label
+    order is kept as returned by promethus
+    """
+    key = tuple((sys.intern(name), sys.intern(value)) for name, value in metric.items())
+    return _label_sets.setdefault(key, key)
+
+class SeriesSet:
+    """
+    Series of a promethus matrix or vector result
+
+    Attributes:
+        label_sets (list): interned (name, value) tuples, one per series
+        timestamps (ndarray): int64 unix timestamps in milliseconds of every sample
+        values (ndarray): float64 values of every sample
+        offsets (ndarray): samples of series i are [offsets[i], offsets[i + 1])
+    """
+
+    def __init__(self, label_sets, timestamps, values, offsets):
+        self.label_sets = label_sets
+        self.timestamps = timestamps
+        self.values = values
+        self.offsets = offsets
+
+    @classmethod
+    def from_json(cls, json_obj, release=False):
+        """
+        Build a SeriesSet from a decoded promethus response, or its data.result list
+
+        Args:
+            json_obj (dict|list): decoded promethus query response
+            release (bool): drop the sample lists from json_obj once converted so
+                            the decoded json can be freed series by series
+        """
+        result = json_obj['data']['result'] if isinstance(json_obj, dict) else json_obj
+        # instant queries carry a single "value" pair instead of "values"
+        samples = [item['values'] if 'values' in item else [item['value']] for item in result]
+        offsets = np.zeros(len(result) + 1, dtype=np.int64)
+        np.cumsum([len(pairs) for pairs in samples], out=offsets[1:])
+        timestamps = np.empty(offsets[-1], dtype=np.int64)
+        values = np.empty(offsets[-1], dtype=np.float64)
+        label_sets = []
+        for i, item in enumerate(result):
+            pairs = samples[i]
+            start, end = offsets[i], offsets[i + 1]
+            n = end - start
+            timestamps[start:end] = np.rint(np.fromiter((pair[0] for pair in pairs), np.float64, n) * 1000)
+            values[start:end] = np.fromiter((pair[1] for pair in pairs), np.float64, n)
+            label_sets.append(intern_labels(item.get('metric', {})))
+            samples[i] = None
+            if release:
+                item.pop('values', None)
+                item.pop('value', None)
+        return cls(label_sets, timestamps, values, offsets)
+
+    def __len__(self):
+        return len(self.label_sets)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.labels(i), self.timestamps_of(i), self.values_of(i)
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + self.values.nbytes + self.offsets.nbytes
+
+    def labels(self, i):
+        return dict(self.label_sets[i])
+
+    def is_empty(self, i):
+        return len(self.label_sets[i]) == 0
+
+    def label(self, i, name, default=None):
+        for key, value in self.label_sets[i]:
+            if key == name:
+                return value
+        return default
+
+    def header(self, i):
+        # json_to_csv column naming, eg. instance_worker-0job_node-exporter
+        return "".join([f"{name}_{value}" for name, value in self.label_sets[i]])
+
+    def name(self, i, names=None, sep="-"):
+        # join the label values, limited to names when given, eg. namespace-pod
+        if names is None:
+            return sep.join([value for _, value in self.label_sets[i]])
+        return sep.join([self.label(i, name, "") for name in names])
+
+    def timestamps_of(self, i):
+        # views into the shared buffers, no copy
+        return self.timestamps[self.offsets[i]:self.offsets[i + 1]]
+
+    def values_of(self, i):
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def seconds_of(self, i):
+        return self.timestamps_of(i) / 1000
+
+    def aligned(self):
+        """
+        Align every series on the union of their timestamps
+
+        Returns:
+            tuple: (int64 millisecond timestamps, float64 matrix shaped (timestamps, series),
+                   bool matrix of the samples present), samples a series does not have
+                   are NaN in the value matrix and False in the present matrix so they
+                   can be told apart from NaN samples returned by promethus
+        """
+        grid = np.unique(self.timestamps)
+        matrix = np.full((len(grid), len(self)), np.nan)
+        present = np.zeros((len(grid), len(self)), dtype=bool)
+        for i in range(len(self)):
+            rows = np.searchsorted(grid, self.timestamps_of(i))
+            matrix[rows, i] = self.values_of(i)
+            present[rows, i] = True
+        return grid, matrix, present
+
+def format_timestamp(ms):
+    """
+    Render a millisecond timestamp the way promethus does, seconds with
+    a fraction only when needed
+    """
+    ms = int(ms)
+    return str(ms // 1000) if ms % 1000 == 0 else repr(ms / 1000)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import csv
+import sys
+import json
+import argparse
+from functools import lru_cache
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Render a manifest of time series plots headless and in parallel.
+#
+# Unlike time_series_plot/time_series_plot_x (matplot-checkpoint.py) every plot
+# gets its own Figure object, nothing goes through the global pyplot state and
+# nothing is shown, so plots can be rendered from a process pool.
+#
+# manifest example, csv paths are relative to the manifest:
+# {
+#   "output_dir": "plots",
+#   "max_points": 2000,
+#   "plots": [
+#     {"csv": "IO pressure by Node.csv", "title": "IO pressure", "ylabel": "%", "per_column": true},
+#     {"csv": "avg-stdv.csv", "columns": ["STDEV"], "title": "cpu stdev", "xlabel": "time", "ylabel": "%"}
+#   ]
+# }
+#
+# usage:
+#   ./batch_plot.py -m manifest.json -j 8
+
+def sys_exit(str):
+    print(f"{str}")
+    sys.exit(1)
+
+def file_is_readable(file_path):
+    if not os.access(file_path, os.R_OK):
+        print(f"The file at '{file_path}' is not readable")
+        return False
+    return True
+
+# deserialize json file, convert json data into python object
+def des_json(path):
+    with open(path) as fd:
+        return json.load(fd)
+
+def parse_value(value):
+    value = value.strip()
+    if value == "":
+        return np.nan
+    # grafana exports percent units as "12.3%", the number is kept as is
+    return float(value.rstrip("%"))
+
+def parse_x(value):
+    try:
+        return datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        # epoch seconds, eg. the timestamp column of prom-extract.py -f output
+        return datetime.fromtimestamp(float(value), tz=timezone.utc)
+
+@lru_cache(maxsize=8)
+def load_csv(path):
+    """
+    Load a wide csv file, either a grafana export (Time column first) or a
+    json_to_csv output (no time column, x becomes the sample index)
+
+    Returns:
+        tuple: (x values, column names, float64 matrix shaped (samples, columns))
+    """
+    with open(path, "r", encoding="utf-8-sig") as file:
+        rows = [row for row in csv.reader(file) if row]
+    if rows and rows[0][0].startswith("sep="):
+        rows = rows[1:]
+    if len(rows) < 2:
+        raise ValueError(f"no data found in {path}")
+    header = rows[0]
+    has_x = header[0].strip().lower() in ("time", "timestamp")
+    columns = header[1:] if has_x else header
+    start = 1 if has_x else 0
+    values = np.array([[parse_value(value) for value in row[start:start + len(columns)]] for row in rows[1:]], dtype=np.float64)
+    x = [parse_x(row[0]) for row in rows[1:]] if has_x else list(range(len(rows) - 1))
+    return x, [column.strip() for column in columns], values
+
+def downsample(x, y, max_points):
+    """
+    Bucket min/max decimation, keeps the peaks of every bucket so spikes
+    survive when thousands of samples are squeezed into one chart
+    """
+    n = len(y)
+    if not max_points or n <= max_points:
+        return x, y
+    buckets = max(max_points // 2, 1)
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    index = []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        if hi <= lo:
+            continue
+        chunk = y[lo:hi]
+        if np.isnan(chunk).all():
+            index.append(lo)
+            continue
+        pair = sorted({lo + int(np.nanargmin(chunk)), lo + int(np.nanargmax(chunk))})
+        index.extend(pair)
+    return [x[i] for i in index], y[index]
+
+def slugify(text):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", text).strip("_")
+
+def expand_manifest(manifest, base_dir):
+    """
+    Expand per_column plots and assign every plot a deterministic output path,
+    a name already taken gets the first free index suffix in manifest order
+    """
+    output_dir = manifest.get("output_dir", "plots")
+    if not os.path.isabs(output_dir):
+        output_dir = os.path.join(base_dir, output_dir)
+    defaults = {"max_points": manifest.get("max_points"), "dpi": manifest.get("dpi", 100)}
+    plots = []
+    used = set()
+    for spec in manifest.get("plots", []):
+        csv_path = spec["csv"] if os.path.isabs(spec["csv"]) else os.path.join(base_dir, spec["csv"])
+        if not file_is_readable(csv_path):
+            sys_exit(f"unable to read {csv_path}")
+        if spec.get("per_column"):
+            _, columns, _ = load_csv(csv_path)
+            selected = spec.get("columns") or columns
+            expanded = [dict(spec, columns=[column], title=f"{spec.get('title', '')} - {column}".strip(" -")) for column in selected]
+        else:
+            expanded = [spec]
+        for plot in expanded:
+            plot = {**defaults, **plot, "csv": csv_path}
+            base = slugify(plot.get("title") or os.path.basename(csv_path)) or "plot"
+            # check every candidate, a title such as "cpu stdev 2" slugs to a suffixed name too
+            name = base
+            n = 2
+            while name in used:
+                name = f"{base}_{n}"
+                n += 1
+            used.add(name)
+            plot["output"] = os.path.join(output_dir, f"{name}.png")
+            plots.append(plot)
+    return plots
+
+def render_plot(plot):
+    """
+    Render one plot spec to a png file with its own Figure object
+    """
+    x, columns, values = load_csv(plot["csv"])
+    selected = plot.get("columns") or columns
+    fig = Figure(figsize=tuple(plot.get("figsize", (10, 5))))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    plotted = 0
+    for column in selected:
+        if column not in columns:
+            print(f"Warning: column '{column}' not found in {plot['csv']}")
+            continue
+        px, py = downsample(x, values[:, columns.index(column)], plot.get("max_points"))
+        ax.plot(px, py, label=column)
+        plotted += 1
+    ax.set_xlabel(plot.get("xlabel", "time"))
+    ax.set_ylabel(plot.get("ylabel", ""))
+    ax.set_title(plot.get("title", ""))
+    if plotted > 1:
+        ax.legend(loc='upper left', bbox_to_anchor=(1.01, 1), fancybox=True, shadow=True, ncol=(plotted - 1) // 30 + 1)
+    if plot.get("ylim_bottom", 0) is not None:
+        ax.set_ylim(bottom=plot.get("ylim_bottom", 0))
+    ax.grid(plot.get("grid", True))
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    fig.savefig(plot["output"], dpi=plot["dpi"], bbox_inches="tight")
+    return plot["output"]
+
+def render_manifest(manifest_path, jobs):
+    manifest = des_json(manifest_path)
+    plots = expand_manifest(manifest, os.path.dirname(os.path.abspath(manifest_path)))
+    if len(plots) == 0:
+        sys_exit(f"no plots found in {manifest_path}")
+    for output_dir in {os.path.dirname(plot["output"]) for plot in plots}:
+        os.makedirs(output_dir, exist_ok=True)
+    print(f"rendering {len(plots)} plots with {jobs} processes")
+    if jobs <= 1:
+        rendered = [render_plot(plot) for plot in plots]
+    else:
+        # consecutive plots mostly share a csv, chunking keeps them on the same
+        # worker so its load_csv cache is hit
+        chunksize = max(len(plots) // (jobs * 4), 1)
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            rendered = list(executor.map(render_plot, plots, chunksize=chunksize))
+    print(f"{len(rendered)} plots saved at {', '.join(sorted({os.path.dirname(path) for path in rendered}))}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="render a manifest of time series plots in parallel.")
+    parser.add_argument('-m', '--manifest', type=str, required=True, help="plot manifest json path")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help="number of rendering processes, default cpu count")
+
+    args = parser.parse_args()
+    render_manifest(args.manifest, args.jobs)